@@ -0,0 +1,146 @@
+from collections import OrderedDict
+from contextlib import contextmanager
+from math import ceil
+from threading import Condition, Lock
+from time import monotonic
+
+from flask import request
+from werkzeug.exceptions import TooManyRequests, ServiceUnavailable
+
+
+class TokenBucketRateLimiter:
+    """In-memory token bucket per client: `rate` tokens per second, up to `burst` tokens."""
+
+    MAX_BUCKETS = 10000
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = OrderedDict()
+        self._lock = Lock()
+
+    def acquire(self, client):
+        """Take a token for the client. Returns None if allowed, else the seconds to wait."""
+        now = monotonic()
+
+        with self._lock:
+            tokens, last = self._buckets.pop(client, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+
+            # Buckets are kept in least recently used order, evicting the oldest ones keeps memory bounded
+            self._buckets[client] = (tokens, now)
+            while len(self._buckets) > self.MAX_BUCKETS:
+                self._buckets.popitem(last=False)
+
+            return None if allowed else (1 - tokens) / self.rate
+
+
+class ConcurrencyLimiter:
+    """Caps concurrent requests, queueing up to `max_queue` more for at most `queue_timeout` seconds."""
+
+    def __init__(self, max_concurrent, max_queue, queue_timeout):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._active = 0
+        self._waiting = 0
+        self._condition = Condition()
+
+    def acquire(self):
+        """Take a slot, waiting in the queue if needed. Returns False if the request is shed."""
+        with self._condition:
+            if self._active < self.max_concurrent:
+                self._active += 1
+                return True
+
+            if self._waiting >= self.max_queue:
+                return False
+
+            self._waiting += 1
+            try:
+                admitted = self._condition.wait_for(lambda: self._active < self.max_concurrent, self.queue_timeout)
+            finally:
+                self._waiting -= 1
+
+            if admitted:
+                self._active += 1
+
+            return admitted
+
+    def release(self):
+        with self._condition:
+            self._active -= 1
+            self._condition.notify()
+
+
+class AdmissionControl:
+    """Per-client rate limiting and concurrency limiting per endpoint class, configured by ADMISSION_LIMITS."""
+
+    def __init__(self, app=None):
+        self._client_header = None
+        self._rate_limiters = {}
+        self._concurrency_limiters = {}
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self._client_header = app.config.get("ADMISSION_CLIENT_HEADER")
+
+        for endpoint_class, limits in app.config.get("ADMISSION_LIMITS", {}).items():
+            if limits.get("rate"):
+                self._rate_limiters[endpoint_class] = TokenBucketRateLimiter(
+                    limits["rate"],
+                    limits.get("burst", 1)
+                )
+
+            if limits.get("max_concurrent"):
+                self._concurrency_limiters[endpoint_class] = ConcurrencyLimiter(
+                    limits["max_concurrent"],
+                    limits.get("max_queue", 0),
+                    limits.get("queue_timeout", 0)
+                )
+
+    def _get_client(self):
+        """Identify the client by the configured header set by a trusted proxy, else by its address."""
+        if self._client_header:
+            value = request.headers.get(self._client_header)
+
+            if value:
+                # The trusted proxy appends the address it saw last, earlier entries can be forged by the client
+                return value.split(",")[-1].strip()
+
+        return request.remote_addr
+
+    @contextmanager
+    def admit(self, endpoint_class):
+        """Admit the current request to an endpoint class, or abort with 429 or 503 and Retry-After."""
+        rate_limiter = self._rate_limiters.get(endpoint_class)
+        if rate_limiter:
+            retry_after = rate_limiter.acquire(self._get_client())
+
+            if retry_after is not None:
+                raise TooManyRequests(
+                    description="Too many requests. Please try again later.",
+                    retry_after=ceil(retry_after)
+                )
+
+        concurrency_limiter = self._concurrency_limiters.get(endpoint_class)
+        if not concurrency_limiter:
+            yield
+            return
+
+        if not concurrency_limiter.acquire():
+            raise ServiceUnavailable(
+                description="The server is busy. Please try again later.",
+                retry_after=max(1, ceil(concurrency_limiter.queue_timeout))
+            )
+
+        try:
+            yield
+        finally:
+            concurrency_limiter.release()
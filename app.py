@@ -1,10 +1,11 @@
 from os import path as os_path, makedirs
 from flask import Flask, url_for
-from extensions import db, migrate
+from extensions import db, migrate, admission, shards
 from flask_apispec import FlaskApiSpec
 from flask_swagger_ui import get_swaggerui_blueprint
 from config import Config, BASE_DIR
-from resources.task_resource import TaskResource, TaskDetailResource, TaskReportResource
+from commands import tasks_cli
+from resources.task_resource import TaskResource, TaskDetailResource, TaskReportResource, TaskExportResource
 from resources.user_resource import UserResource, UserDetailResource
 
 
@@ -18,6 +19,11 @@ def create_app():
     # Database
     db.init_app(app)
     migrate.init_app(app, db)
+    shards.init_app(app, db)
+    app.cli.add_command(tasks_cli)
+
+    # Admission control
+    admission.init_app(app)
 
     # Swagger
     swagger_url = "/swagger"
@@ -29,6 +35,7 @@ def create_app():
     app.add_url_rule("/tasks", view_func=TaskResource.as_view("tasks"))
     app.add_url_rule("/tasks/<int:task_id>", view_func=TaskDetailResource.as_view("task_detail"))
     app.add_url_rule("/reports/tasks/time_spent", view_func=TaskReportResource.as_view("task_report"))
+    app.add_url_rule("/exports/tasks", view_func=TaskExportResource.as_view("task_export"))
     app.add_url_rule("/users", view_func=UserResource.as_view("users"))
     app.add_url_rule("/users/<int:user_id>", view_func=UserDetailResource.as_view("user_detail"))
 
@@ -37,6 +44,7 @@ def create_app():
     docs.register(TaskResource, endpoint="tasks")
     docs.register(TaskDetailResource, endpoint="task_detail")
     docs.register(TaskReportResource, endpoint="task_report")
+    docs.register(TaskExportResource, endpoint="task_export")
     docs.register(UserResource, endpoint="users")
     docs.register(UserDetailResource, endpoint="user_detail")
 
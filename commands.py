@@ -0,0 +1,98 @@
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import create_engine, delete, insert, select, text
+
+from extensions import db, shards
+from models.task import Task
+from models.task_shard import TaskShard
+from sharding import get_table_sql
+
+
+tasks_cli = AppGroup("tasks", help="Manage the storage of tasks.")
+
+
+def _rebuild_tasks_table(tasks_table):
+    """Recreate the tasks table with AUTOINCREMENT, keeping its rows, if it was created without it."""
+    with db.engine.begin() as connection:
+        tasks_sql = get_table_sql(connection, tasks_table.name)
+
+        if tasks_sql is None:
+            raise click.ClickException("The tasks table does not exist, run `flask db upgrade` first.")
+
+        if "AUTOINCREMENT" in tasks_sql.upper():
+            return False
+
+        columns = ", ".join(column.name for column in tasks_table.columns)
+
+        connection.execute(text("ALTER TABLE tasks RENAME TO tasks_old"))
+        tasks_table.create(connection)
+        connection.execute(text(f"INSERT INTO tasks ({columns}) SELECT {columns} FROM tasks_old"))
+        connection.execute(text("DROP TABLE tasks_old"))
+
+    return True
+
+
+@tasks_cli.command("shard")
+@click.option("--count", type=click.IntRange(min=1), required=True,
+              help="Number of shards, the TASK_SHARD_COUNT to enable afterwards.")
+@click.option("--batch-size", type=click.IntRange(min=1, max=500), default=500,
+              help="Number of tasks moved per transaction.")
+def shard_tasks(count, batch_size):
+    """Prepare the default database for sharding and move assigned tasks to their shard.
+
+    Run it with the application stopped and TASK_SHARD_COUNT = 0, then set TASK_SHARD_COUNT to COUNT.
+    The command can be run again after a failure.
+    """
+    if shards.enabled:
+        raise click.ClickException("Sharding is already enabled, run this command with TASK_SHARD_COUNT = 0.")
+
+    tasks_table = Task.__table__
+    task_shards_table = TaskShard.__table__
+
+    if _rebuild_tasks_table(tasks_table):
+        click.echo("Recreated the tasks table with AUTOINCREMENT.")
+
+    task_shards_table.create(db.engine, checkfirst=True)
+
+    shard_engines = []
+    for shard in range(count):
+        engine = create_engine(current_app.config["TASK_SHARD_DATABASE_URI"].format(shard=shard))
+        tasks_table.create(engine, checkfirst=True)
+        shard_engines.append(engine)
+
+    moved_tasks = 0
+
+    with db.engine.connect() as default_connection:
+        while True:
+            rows = default_connection.execute(
+                select(tasks_table).where(tasks_table.c.user_id.is_not(None))
+                .order_by(tasks_table.c.id).limit(batch_size)
+            ).mappings().all()
+
+            if not rows:
+                break
+
+            rows_by_shard = {}
+            for row in rows:
+                rows_by_shard.setdefault(row["user_id"] % count, []).append(dict(row))
+
+            # Tasks are written to their shard before leaving the default database, so a failure
+            # in between only leaves copies that the next run overwrites
+            for shard, shard_rows in rows_by_shard.items():
+                with shard_engines[shard].begin() as shard_connection:
+                    shard_connection.execute(insert(tasks_table).prefix_with("OR REPLACE"), shard_rows)
+
+            default_connection.execute(
+                insert(task_shards_table).prefix_with("OR REPLACE"),
+                [{"task_id": row["id"], "shard": row["user_id"] % count} for row in rows]
+            )
+            default_connection.execute(delete(tasks_table).where(tasks_table.c.id.in_([row["id"] for row in rows])))
+            default_connection.commit()
+
+            moved_tasks += len(rows)
+
+    for engine in shard_engines:
+        engine.dispose()
+
+    click.echo(f"Moved {moved_tasks} tasks to {count} shards. Set TASK_SHARD_COUNT = {count} to enable sharding.")
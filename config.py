@@ -7,7 +7,25 @@ BASE_DIR = os.path.abspath(os.path.dirname(__file__))
 class Config:
     SQLALCHEMY_DATABASE_URI = f"sqlite:///{os.path.join(BASE_DIR, 'db', 'tasks.db')}"
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    TASK_SHARD_COUNT = 0  # 0 keeps every task in SQLALCHEMY_DATABASE_URI
+    TASK_SHARD_DATABASE_URI = f"sqlite:///{os.path.join(BASE_DIR, 'db', 'tasks_shard_{shard}.db')}"
     SECRET_KEY = "please_change_me"
     APISPEC_TITLE = "Task Management API"
     APISPEC_VERSION = "1.0.0"
     SERVER_NAME = "localhost:5000"
+    REPORT_GRAPH_DEFAULT_LIMIT = 20
+    REPORT_GRAPH_MAX_LIMIT = 100
+    REPORT_GRAPH_DEFAULT_BINS = 10
+    REPORT_GRAPH_MAX_BINS = 50
+    # Header holding the client address when running behind a trusted reverse proxy (e.g. "X-Forwarded-For"),
+    # None identifies clients by their remote address
+    ADMISSION_CLIENT_HEADER = None
+    ADMISSION_LIMITS = {
+        "report_render": {
+            "max_concurrent": 2,  # concurrent renders
+            "max_queue": 4,  # renders waiting for a slot
+            "queue_timeout": 10,  # seconds
+            "rate": 0.5,  # tokens per second per client
+            "burst": 3,  # tokens per client
+        },
+    }
@@ -1,41 +1,74 @@
-from matplotlib import pyplot as plt
-from io import BytesIO
+import csv
+import heapq
+import json
+from enum import Enum
+from functools import lru_cache
+from itertools import islice
+from matplotlib.figure import Figure
+from io import BytesIO, StringIO
 from reportlab.lib.pagesizes import letter
 from reportlab.pdfgen import canvas
 from datetime import datetime, timezone
-from sqlalchemy import func, desc, asc
+from sqlalchemy import func, desc, asc, case, cast, Integer
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import object_session
 
 from controllers.user_controller import get_user_by_id
+from extensions import shards
 from enums.task_status import TaskStatus
 from enums.order_type import OrderType
+from enums.graph_mode_type import GraphModeType
+from enums.export_format_type import ExportFormatType
 
 
 from models.task import Task, db
+from models.user import User
+from models.task_shard import TaskShard
+
+
+def _get_sort_key(column_name, descending=False):
+    """Get a key sorting tasks by a column like the database does (NULLs first, enums by name).
+
+    Ties are broken by ascending ID, also when sorting in descending order.
+    """
+    def sort_key(task):
+        value = getattr(task, column_name)
+
+        if isinstance(value, Enum):
+            value = value.name
+
+        return value is not None, value, -task.id if descending else task.id
+
+    return sort_key
 
 
 def get_all_tasks(status=None, sort_by=None, order=OrderType.ASC):
-    """Get all tasks that are not soft-deleted, with optional filtering and sorting."""
-    query = Task.query.filter_by(date_deleted=None)
+    """Get all tasks that are not soft-deleted, with optional filtering and sorting.
 
-    if status:
-        query = query.filter(Task.status == status)
+    Every shard is queried in parallel and the sorted results are merged.
+    """
+    sort_column = sort_by if sort_by and sort_by in Task.__table__.columns else 'id'
+    descending = order == OrderType.DESC
+    direction = desc if descending else asc
 
-    if sort_by:
-        if order == OrderType.DESC:
-            query = query.order_by(desc(getattr(Task, sort_by, 'id')))
-        else:
-            query = query.order_by(asc(getattr(Task, sort_by, 'id')))
+    def query_shard(session):
+        query = session.query(Task).filter_by(date_deleted=None)
 
-    print(f"query: {query}")
+        if status:
+            query = query.filter(Task.status == status)
 
-    return query.all()
+        return query.order_by(direction(getattr(Task, sort_column)), asc(Task.id)).all()
 
+    shard_tasks = shards.scatter(query_shard)
+
+    return list(heapq.merge(*shard_tasks, key=_get_sort_key(sort_column, descending), reverse=descending))
 
 
 def get_task_by_id(task_id):
-    """Get a task by its ID if not soft-deleted."""
-    return Task.query.filter_by(id=task_id, date_deleted=None).first()
+    """Get a task by its ID if not soft-deleted, from the shard holding it."""
+    session = shards.session_for_task(task_id)
+
+    return session.query(Task).filter_by(id=task_id, date_deleted=None).first()
 
 
 def create_task(title, description=""):
@@ -58,7 +91,7 @@ def delete_task(task_id):
 
     if task:
         task.date_deleted = func.now()
-        db.session.commit()
+        object_session(task).commit()
         return task
 
     return None
@@ -97,7 +130,7 @@ def update_task_status(task_id, new_status_value):
         task.status = TaskStatus.OPEN
         task.time_spent = 0
 
-    db.session.commit()
+    object_session(task).commit()
 
     return task, 200
 
@@ -112,15 +145,51 @@ def assign_task_to_user(task_id, user_id):
     if not user:
         return None, 404
 
-    try:
-        task.user_id = user_id
-        db.session.commit()
+    # Complete an earlier move of this task that failed before its old copy was deleted
+    shards.remove_stale_copy(task_id)
+
+    source_session = object_session(task)
+    target_session = shards.session_for_user(user_id)
 
-        return task, 200
+    if source_session is target_session:
+        try:
+            task.user_id = user_id
+            source_session.commit()
+
+            return task, 200
+        except IntegrityError:
+            source_session.rollback()
+            return None, 400
+
+    # The task moves to the shard of its new user. It is written there first, then the shard directory
+    # points to it and records the old shard until the copy there is deleted. A failure in between
+    # leaves a stale copy rather than losing the task; it is deleted by the next move of the task
+    # or when the application starts.
+    moved_task = Task(task.title, task.description, task.status)
+    for column in Task.__table__.columns:
+        setattr(moved_task, column.key, getattr(task, column.key))
+    moved_task.user_id = user_id
+    moved_task.date_modified = func.now()
+
+    try:
+        moved_task = target_session.merge(moved_task)
+        target_session.commit()
     except IntegrityError:
-        db.session.rollback()
+        target_session.rollback()
         return None, 400
 
+    # When the task leaves the default database, the directory update and the removal commit together
+    source_shard = shards.shard_for_user(task.user_id)
+    db.session.merge(TaskShard(task_id=task_id, shard=shards.shard_for_user(user_id), previous_shard=source_shard))
+    source_session.delete(task)
+    db.session.commit()
+
+    if source_shard is not None:
+        source_session.commit()
+        shards.remove_stale_copy(task_id)
+
+    return moved_task, 200
+
 
 def format_time_spent(total_seconds):
     """Convert time in seconds to 'D H:M:SS' format."""
@@ -143,12 +212,35 @@ def format_time_spent(total_seconds):
         return f"{mins}m {secs:02d}s"
 
 
+def _get_usernames(user_ids, chunk_size=500):
+    """Get the usernames of users by their IDs, as users are only stored in the default database."""
+    user_ids = list({user_id for user_id in user_ids if user_id is not None})
+    usernames = {}
+
+    for i in range(0, len(user_ids), chunk_size):
+        usernames.update(
+            db.session.query(User.id, User.username).filter(User.id.in_(user_ids[i:i + chunk_size])).all()
+        )
+
+    return usernames
+
+
+def _get_time_spent_tasks():
+    """Get the tasks with time spent from every shard, ordered by ID."""
+    shard_tasks = shards.scatter(
+        lambda session: session.query(Task).filter(
+            Task.date_deleted.is_(None),
+            Task.time_spent > 0
+        ).order_by(asc(Task.id)).all()
+    )
+
+    return list(heapq.merge(*shard_tasks, key=lambda task: task.id))
+
+
 def get_task_time_spent_report():
     """Get a report of time spent on every task."""
-    tasks = Task.query.filter(
-        Task.date_deleted.is_(None),
-        Task.time_spent > 0
-    ).all()
+    tasks = _get_time_spent_tasks()
+    usernames = _get_usernames(task.user_id for task in tasks)
 
     report_data = [
         {
@@ -156,7 +248,7 @@ def get_task_time_spent_report():
             'title': task.title,
             'time_spent': format_time_spent(task.time_spent),
             'user_id': task.user_id,
-            'username': task.user.username if task.user else None,
+            'username': usernames.get(task.user_id),
             'status': task.status.value,
         }
         for task in tasks
@@ -165,61 +257,156 @@ def get_task_time_spent_report():
     return report_data
 
 
-def generate_task_time_spent_graph():
-    """Generate a graph of time spent on every task with adaptive time units."""
-    tasks = Task.query.filter(
-        Task.date_deleted.is_(None),
-        Task.time_spent > 0
-    ).all()
+def _get_time_unit(max_time_spent):
+    """Pick the time unit (divisor in seconds and name) fitting the largest value."""
+    if max_time_spent >= 86400:  # 1 day
+        return 86400, 'days'
+    elif max_time_spent >= 3600:  # 1 hour
+        return 3600, 'hours'
+
+    return 60, 'minutes'  # 1 minute
+
+
+def _get_top_tasks_graph_data(limit):
+    """Get the titles and time spent of the N tasks with the most time spent."""
+    shard_rows = shards.scatter(
+        lambda session: session.query(Task.title, Task.time_spent).filter(
+            Task.date_deleted.is_(None),
+            Task.time_spent > 0
+        ).order_by(desc(Task.time_spent)).limit(limit).all()
+    )
+
+    rows = list(islice(heapq.merge(*shard_rows, key=lambda row: row.time_spent, reverse=True), limit))
 
-    if not tasks:
+    if not rows:
         return None
 
-    task_titles = []
-    time_spent_seconds = []
+    divisor, time_unit = _get_time_unit(rows[0].time_spent)
 
-    for task in tasks:
-        task_titles.append(task.title)
-        time_spent_seconds.append(task.time_spent)
+    labels = tuple(row.title for row in rows)
+    values = tuple(row.time_spent / divisor for row in rows)
 
-    max_time_spent = max(time_spent_seconds)
+    return labels, values, "Task", f"Time Spent ({time_unit})", f"Top {len(rows)} Tasks by Time Spent ({time_unit.capitalize()})"
 
-    if max_time_spent >= 86400:  # 1 day
-        time_unit = 'days'
-        time_spent = [t / 86400 for t in time_spent_seconds]
-        ylabel = "Time Spent (days)"
-    elif max_time_spent >= 3600:  # 1 hour
-        time_unit = 'hours'
-        time_spent = [t / 3600 for t in time_spent_seconds]
-        ylabel = "Time Spent (hours)"
-    else:
-        time_unit = 'minutes'
-        time_spent = [t / 60 for t in time_spent_seconds]  # 1 minute
-        ylabel = "Time Spent (minutes)"
-
-    # Plot the graph
-    plt.figure(figsize=(10, 6))
-    plt.bar(task_titles, time_spent, color="skyblue")
-    plt.xlabel("Task")
-    plt.ylabel(ylabel)
-    plt.title(f"Time Spent on Tasks ({time_unit.capitalize()})")
-    plt.xticks(rotation=45, ha="right")
+
+def _get_histogram_graph_data(bins):
+    """Get the number of tasks per time spent bucket, counted in the database."""
+    shard_bounds = [
+        bounds for bounds in shards.scatter(
+            lambda session: session.query(
+                func.min(Task.time_spent),
+                func.max(Task.time_spent)
+            ).filter(
+                Task.date_deleted.is_(None),
+                Task.time_spent > 0
+            ).one()
+        )
+        if bounds[1] is not None
+    ]
+
+    if not shard_bounds:
+        return None
+
+    min_time_spent = min(bounds[0] for bounds in shard_bounds)
+    max_time_spent = max(bounds[1] for bounds in shard_bounds)
+
+    bucket_width = (max_time_spent - min_time_spent) / bins or 1
+    bucket = case(
+        (Task.time_spent >= max_time_spent, bins - 1),
+        else_=cast((Task.time_spent - min_time_spent) / bucket_width, Integer)
+    ).label("bucket")
+
+    shard_rows = shards.scatter(
+        lambda session: session.query(bucket, func.count(Task.id)).filter(
+            Task.date_deleted.is_(None),
+            Task.time_spent > 0
+        ).group_by(bucket).all()
+    )
+
+    counts = [0] * bins
+    for rows in shard_rows:
+        for bucket_index, count in rows:
+            counts[min(bucket_index, bins - 1)] += count
+
+    divisor, time_unit = _get_time_unit(max_time_spent)
+
+    labels = tuple(
+        f"{(min_time_spent + i * bucket_width) / divisor:.1f}-{(min_time_spent + (i + 1) * bucket_width) / divisor:.1f}"
+        for i in range(bins)
+    )
+
+    return labels, tuple(counts), f"Time Spent ({time_unit})", "Tasks", "Distribution of Time Spent on Tasks"
+
+
+def _get_user_totals_graph_data(limit):
+    """Get the total time spent per user for the N users with the most time spent."""
+    total_time_spent = func.sum(Task.time_spent).label("total_time_spent")
+
+    # Every user's tasks live in a single shard (checked at startup), so the top N of each shard is enough
+    shard_rows = shards.scatter(
+        lambda session: session.query(Task.user_id, total_time_spent).filter(
+            Task.date_deleted.is_(None),
+            Task.time_spent > 0
+        ).group_by(Task.user_id).order_by(desc(total_time_spent)).limit(limit).all()
+    )
+
+    rows = heapq.nlargest(limit, (row for rows in shard_rows for row in rows), key=lambda row: row.total_time_spent)
+
+    if not rows:
+        return None
+
+    divisor, time_unit = _get_time_unit(rows[0].total_time_spent)
+    usernames = _get_usernames(row.user_id for row in rows)
+
+    labels = tuple(usernames.get(row.user_id, "Unassigned") for row in rows)
+    values = tuple(row.total_time_spent / divisor for row in rows)
+
+    return labels, values, "User", f"Time Spent ({time_unit})", f"Time Spent per User ({time_unit.capitalize()})"
+
+
+@lru_cache(maxsize=32)
+def _render_bar_chart(labels, values, xlabel, ylabel, title, image_format):
+    """Render a bar chart to image bytes, cached by its (already reduced) data."""
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+
+    ax.bar(range(len(values)), values, color="skyblue", tick_label=labels)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+    ax.set_title(title)
+    ax.tick_params(axis="x", labelrotation=45)
+    for tick_label in ax.get_xticklabels():
+        tick_label.set_horizontalalignment("right")
 
     buf = BytesIO()
-    plt.tight_layout()
-    plt.savefig(buf, format="png")
-    buf.seek(0)
-    plt.close()
+    fig.tight_layout()
+    fig.savefig(buf, format=image_format)
 
     return buf.getvalue()
 
 
+def generate_task_time_spent_graph(graph_mode=GraphModeType.TOP_TASKS, limit=20, bins=10, image_format="png"):
+    """Generate a graph of time spent on tasks with adaptive time units.
+
+    The data is reduced in the database (top N tasks, histogram buckets or per-user totals),
+    so the rendering cost does not depend on the number of tasks.
+    """
+    if graph_mode == GraphModeType.HISTOGRAM:
+        graph_data = _get_histogram_graph_data(bins)
+    elif graph_mode == GraphModeType.USER_TOTALS:
+        graph_data = _get_user_totals_graph_data(limit)
+    else:
+        graph_data = _get_top_tasks_graph_data(limit)
+
+    if not graph_data:
+        return None
+
+    return _render_bar_chart(*graph_data, image_format)
+
+
 def generate_task_time_spent_pdf():
     """Generate a PDF report of time spent on every task."""
-    tasks = Task.query.filter(
-        Task.date_deleted.is_(None),
-        Task.time_spent > 0
-    ).all()
+    tasks = _get_time_spent_tasks()
 
     buffer = BytesIO()
     ctx = canvas.Canvas(buffer, pagesize=letter)
@@ -252,3 +439,112 @@ def generate_task_time_spent_pdf():
 
     return buffer.getvalue()
 
+
+
+EXPORT_COLUMNS = [
+    "id",
+    "title",
+    "description",
+    "status",
+    "time_spent",
+    "date_started_at",
+    "date_created",
+    "date_modified",
+    "date_deleted",
+    "user_id",
+    "username",
+]
+
+
+def _get_export_rows(session, since_modified=None, since_id=None, batch_size=1000):
+    """Yield the tasks of a shard ordered by ID, reading them in keyset batches.
+
+    Each batch is read in its own short transaction, so a slow download does not hold
+    SQLite's read lock and block writers.
+    Soft-deleted tasks are included, so incremental exports also carry deletions.
+    Dates are stored to the second, so tasks modified at exactly `since_modified` are
+    exported again and clients must dedupe them by ID.
+    """
+    query = session.query(
+        Task.id,
+        Task.title,
+        Task.description,
+        Task.status,
+        Task.time_spent,
+        Task.date_started_at,
+        Task.date_created,
+        Task.date_modified,
+        Task.date_deleted,
+        Task.user_id,
+    )
+
+    if since_modified:
+        # SQLite stores dates as 'YYYY-MM-DD HH:MM:SS' text, compare them in the same format
+        query = query.filter(
+            func.datetime(func.coalesce(Task.date_modified, Task.date_created))
+            >= since_modified.strftime("%Y-%m-%d %H:%M:%S")
+        )
+
+    last_id = since_id
+
+    while True:
+        batch_query = query if last_id is None else query.filter(Task.id > last_id)
+        rows = batch_query.order_by(asc(Task.id)).limit(batch_size).all()
+
+        # End the read transaction before the batch is sent to the client
+        session.commit()
+
+        yield from rows
+
+        if len(rows) < batch_size:
+            return
+
+        last_id = rows[-1].id
+
+
+def _get_export_records(since_modified=None, since_id=None, batch_size=1000):
+    """Yield every task with its username, merging the shards by ID."""
+    rows = heapq.merge(
+        *(_get_export_rows(session, since_modified, since_id, batch_size) for session in shards.sessions()),
+        key=lambda row: row.id
+    )
+
+    while batch := list(islice(rows, batch_size)):
+        usernames = _get_usernames(row.user_id for row in batch)
+
+        for row in batch:
+            yield {
+                "id": row.id,
+                "title": row.title,
+                "description": row.description,
+                "status": row.status.name if row.status else None,
+                "time_spent": row.time_spent,
+                "date_started_at": row.date_started_at.isoformat() if row.date_started_at else None,
+                "date_created": row.date_created.isoformat() if row.date_created else None,
+                "date_modified": row.date_modified.isoformat() if row.date_modified else None,
+                "date_deleted": row.date_deleted.isoformat() if row.date_deleted else None,
+                "user_id": row.user_id,
+                "username": usernames.get(row.user_id),
+            }
+
+
+def generate_task_export(export_format, since_modified=None, since_id=None):
+    """Generate an export of tasks line by line, in CSV or NDJSON format."""
+    rows = _get_export_records(since_modified, since_id)
+
+    if export_format == ExportFormatType.NDJSON:
+        for row in rows:
+            yield json.dumps(row) + "\n"
+        return
+
+    buf = StringIO()
+    writer = csv.DictWriter(buf, fieldnames=EXPORT_COLUMNS)
+    writer.writeheader()
+
+    for row in rows:
+        writer.writerow(row)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate(0)
+
+    yield buf.getvalue()
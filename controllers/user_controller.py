@@ -1,8 +1,36 @@
 from sqlalchemy import func
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.attributes import set_committed_value
 
+from extensions import shards
+from models.task import Task
 from models.user import User, db
 
+
+def _load_sharded_tasks(users, chunk_size=500):
+    """Load the tasks of users from their shard, as the tasks relationship only sees the default database."""
+    if not shards.enabled:
+        return users
+
+    users_by_session = {}
+    for user in users:
+        users_by_session.setdefault(shards.session_for_user(user.id), []).append(user)
+
+    for session, session_users in users_by_session.items():
+        tasks_by_user = {}
+
+        for i in range(0, len(session_users), chunk_size):
+            user_ids = [user.id for user in session_users[i:i + chunk_size]]
+
+            for task in session.query(Task).filter(Task.user_id.in_(user_ids)):
+                tasks_by_user.setdefault(task.user_id, []).append(task)
+
+        for user in session_users:
+            set_committed_value(user, "tasks", tasks_by_user.get(user.id, []))
+
+    return users
+
+
 def create_user(username, email, password):
     user_exists = db.session.query(
         db.session.query(User).filter(
@@ -32,11 +60,16 @@ def create_user(username, email, password):
 
 
 def get_all_users():
-    return User.query.filter_by(deleted_at=None).all()
+    return _load_sharded_tasks(User.query.filter_by(deleted_at=None).all())
 
 
 def get_user_by_id(user_id):
-    return User.query.filter_by(id=user_id, deleted_at=None).first()
+    user = User.query.filter_by(id=user_id, deleted_at=None).first()
+
+    if user:
+        _load_sharded_tasks([user])
+
+    return user
 
 
 def delete_user(user_id):
@@ -45,6 +78,7 @@ def delete_user(user_id):
     if user:
         user.deleted_at = func.now()
         db.session.commit()
+        _load_sharded_tasks([user])
         return user
 
     return None
@@ -0,0 +1,6 @@
+from enum import Enum
+
+
+class ExportFormatType(Enum):
+    CSV = "csv"
+    NDJSON = "ndjson"
@@ -0,0 +1,7 @@
+from enum import Enum
+
+
+class GraphModeType(Enum):
+    TOP_TASKS = 1
+    HISTOGRAM = 2
+    USER_TOTALS = 3
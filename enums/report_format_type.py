@@ -5,4 +5,4 @@ class ReportFormatType(Enum):
     JSON = 1
     GRAPH = 2
     PDF = 3
-
+    SVG = 4
@@ -1,6 +1,10 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
+from admission import AdmissionControl
+from sharding import TaskShards
 
 
 db = SQLAlchemy()
 migrate = Migrate()
+admission = AdmissionControl()
+shards = TaskShards()
@@ -6,6 +6,8 @@ from enums.task_status import TaskStatus
 
 class Task(db.Model):
     __tablename__ = "tasks"
+    # IDs are never reused, as tasks moved to another shard keep their ID
+    __table_args__ = {"sqlite_autoincrement": True}
     id = db.Column(db.Integer, primary_key=True)
     title = db.Column(db.String(100), nullable=False)
     description = db.Column(db.String(200))
@@ -0,0 +1,10 @@
+from extensions import db
+
+
+class TaskShard(db.Model):
+    """Directory of the shard holding each task moved out of the default database."""
+    __tablename__ = "task_shards"
+    task_id = db.Column(db.Integer, primary_key=True)
+    shard = db.Column(db.Integer, nullable=False)
+    # Shard still holding a copy of the task while a move is in progress
+    previous_shard = db.Column(db.Integer)
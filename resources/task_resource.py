@@ -1,6 +1,10 @@
-from flask import request, abort, Response
+from datetime import datetime, timezone
+from flask import request, abort, Response, current_app, stream_with_context
 from flask_apispec import MethodResource, doc, marshal_with, use_kwargs
 
+from extensions import admission
+from enums.export_format_type import ExportFormatType
+from enums.graph_mode_type import GraphModeType
 from enums.report_format_type import ReportFormatType
 from enums.task_status import TaskStatus
 from enums.order_type import OrderType
@@ -8,7 +12,8 @@ from enums.order_type import OrderType
 from schemas.task import TaskSchema, TaskRequestSchema, TaskStatusUpdateSchema, TaskAssigneeUpdateSchema, \
     TaskReportSchema
 from controllers.task_controller import get_all_tasks, get_task_by_id, create_task, delete_task, update_task_status, \
-    assign_task_to_user, get_task_time_spent_report, generate_task_time_spent_graph, generate_task_time_spent_pdf
+    assign_task_to_user, get_task_time_spent_report, generate_task_time_spent_graph, generate_task_time_spent_pdf, \
+    generate_task_export
 
 
 class TaskResource(MethodResource):
@@ -118,10 +123,25 @@ class TaskReportResource(MethodResource):
          tags=["Reports"],
          params={
             "report_format": {
-                "description": "Format of the report (1=JSON, 2=GRAPH, 3=PDF)",
+                "description": "Format of the report (1=JSON, 2=GRAPH, 3=PDF, 4=SVG)",
                 "in": "query",
                 "type": "integer",
                 "required": True
+            },
+            "graph_mode": {
+                "description": "Graph mode for GRAPH and SVG reports (1=TOP_TASKS, 2=HISTOGRAM, 3=USER_TOTALS)",
+                "in": "query",
+                "type": "integer"
+            },
+            "limit": {
+                "description": "Number of tasks or users drawn in TOP_TASKS and USER_TOTALS graphs",
+                "in": "query",
+                "type": "integer"
+            },
+            "bins": {
+                "description": "Number of time spent buckets drawn in HISTOGRAM graphs",
+                "in": "query",
+                "type": "integer"
             }
          })
     @marshal_with(TaskReportSchema(many=True))
@@ -131,20 +151,29 @@ class TaskReportResource(MethodResource):
         report_format = None
 
         try:
-            print(report_format_value)
             report_format = ReportFormatType(report_format_value)
         except ValueError:
-            abort(400, description="Invalid status value provided. Must be 1=JSON or 2=GRAPH or 3=PDF.")
+            abort(400, description="Invalid status value provided. Must be 1=JSON or 2=GRAPH or 3=PDF or 4=SVG.")
 
         result = None, 400
 
         if report_format == ReportFormatType.JSON:
             result = get_task_time_spent_report()
-        elif report_format == ReportFormatType.GRAPH:
-            image_data = generate_task_time_spent_graph()
-            result = Response(image_data, mimetype="image/png")
+        elif report_format in (ReportFormatType.GRAPH, ReportFormatType.SVG):
+            graph_mode, limit, bins = self._get_graph_args()
+            image_format, mimetype = ("svg", "image/svg+xml") if report_format == ReportFormatType.SVG \
+                else ("png", "image/png")
+
+            with admission.admit("report_render"):
+                image_data = generate_task_time_spent_graph(graph_mode, limit, bins, image_format)
+
+            if not image_data:
+                abort(404, description="There is no time spent on tasks to report.")
+
+            result = Response(image_data, mimetype=mimetype)
         elif report_format == ReportFormatType.PDF:
-            pdf_data = generate_task_time_spent_pdf()
+            with admission.admit("report_render"):
+                pdf_data = generate_task_time_spent_pdf()
 
             result = Response(
                 pdf_data,
@@ -157,3 +186,92 @@ class TaskReportResource(MethodResource):
 
         return result
 
+
+    @staticmethod
+    def _get_graph_args():
+        graph_mode_value = request.args.get("graph_mode", default=GraphModeType.TOP_TASKS.value, type=int)
+
+        graph_mode = None
+
+        try:
+            graph_mode = GraphModeType(graph_mode_value)
+        except ValueError:
+            abort(400, description="Invalid graph mode provided. Must be 1=TOP_TASKS or 2=HISTOGRAM or 3=USER_TOTALS.")
+
+        max_limit = current_app.config["REPORT_GRAPH_MAX_LIMIT"]
+        limit = request.args.get("limit", default=current_app.config["REPORT_GRAPH_DEFAULT_LIMIT"], type=int)
+        if not 0 < limit <= max_limit:
+            abort(400, description=f"Limit must be between 1 and {max_limit}.")
+
+        max_bins = current_app.config["REPORT_GRAPH_MAX_BINS"]
+        bins = request.args.get("bins", default=current_app.config["REPORT_GRAPH_DEFAULT_BINS"], type=int)
+        if not 0 < bins <= max_bins:
+            abort(400, description=f"Bins must be between 1 and {max_bins}.")
+
+        return graph_mode, limit, bins
+
+
+class TaskExportResource(MethodResource):
+    @doc(description="Stream an export of all tasks, optionally only those changed since a given point",
+         tags=["Exports"],
+         params={
+            "format": {
+                "description": "Format of the export (csv or ndjson)",
+                "in": "query",
+                "type": "string",
+                "required": True
+            },
+            "since_modified": {
+                "description": "Only export tasks created or modified at or after this ISO 8601 date "
+                               "(rows modified at exactly this date are repeated, dedupe them by id)",
+                "in": "query",
+                "type": "string"
+            },
+            "since_id": {
+                "description": "Only export tasks with an ID greater than this one",
+                "in": "query",
+                "type": "integer"
+            }
+         })
+    def get(self):
+        export_format = None
+
+        try:
+            export_format = ExportFormatType(request.args.get("format"))
+        except ValueError:
+            abort(400, description="Invalid format provided. Must be csv or ndjson.")
+
+        since_modified_value = request.args.get("since_modified")
+        since_modified = None
+        if since_modified_value is not None:
+            try:
+                since_modified = datetime.fromisoformat(since_modified_value)
+            except ValueError:
+                abort(400, description="Invalid since_modified provided. Must be an ISO 8601 date.")
+
+            # Dates are stored as naive UTC, to the second
+            if since_modified.tzinfo:
+                since_modified = since_modified.astimezone(timezone.utc).replace(tzinfo=None)
+            since_modified = since_modified.replace(microsecond=0)
+
+        since_id_value = request.args.get("since_id")
+        since_id = None
+        if since_id_value is not None:
+            try:
+                since_id = int(since_id_value)
+            except ValueError:
+                abort(400, description="Invalid since_id provided. Must be an integer.")
+
+            if since_id < 0:
+                abort(400, description="since_id must be greater than or equal to 0.")
+
+        if export_format == ExportFormatType.NDJSON:
+            mimetype, filename = "application/x-ndjson", "tasks.ndjson"
+        else:
+            mimetype, filename = "text/csv", "tasks.csv"
+
+        return Response(
+            stream_with_context(generate_task_export(export_format, since_modified, since_id)),
+            mimetype=mimetype,
+            headers={"Content-Disposition": f"attachment;filename={filename}"}
+        )
@@ -0,0 +1,202 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import create_engine, delete, func, select, text, update
+from sqlalchemy.orm import Session, scoped_session, sessionmaker
+
+
+def get_table_sql(connection, table_name):
+    """Get the CREATE TABLE statement of a SQLite table, None if it does not exist."""
+    return connection.execute(
+        text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {"name": table_name}
+    ).scalar()
+
+
+class TaskShards:
+    """Optional partitioning of the tasks table across several databases by user ID.
+
+    Unassigned tasks stay in the default database (SQLALCHEMY_DATABASE_URI), tasks of a user
+    live in shard `user_id % TASK_SHARD_COUNT`. The `task_shards` table of the default database
+    records the shard of every task moved out of it, so single-task operations go straight to it.
+    Sharding is disabled when TASK_SHARD_COUNT is 0, in which case every operation runs on the
+    default session.
+    """
+
+    def __init__(self, app=None, db=None):
+        self.db = db
+        self.shard_count = 0
+        self._engines = []
+        self._sessions = []
+        self._executor = None
+
+        if app is not None:
+            self.init_app(app, db)
+
+    @property
+    def enabled(self):
+        return self.shard_count > 0
+
+    def init_app(self, app, db):
+        self.db = db
+        self.shard_count = app.config.get("TASK_SHARD_COUNT", 0)
+
+        if not self.enabled:
+            return
+
+        tasks_table = db.metadata.tables["tasks"]
+
+        with app.app_context():
+            self._check_default_database(db.engine, tasks_table)
+            db.metadata.tables["task_shards"].create(db.engine, checkfirst=True)
+
+        for shard in range(self.shard_count):
+            engine = create_engine(app.config["TASK_SHARD_DATABASE_URI"].format(shard=shard))
+            tasks_table.create(engine, checkfirst=True)
+
+            self._engines.append(engine)
+            self._sessions.append(scoped_session(sessionmaker(bind=engine)))
+
+        with app.app_context():
+            shard_connections = [engine.connect() for engine in self._engines]
+            try:
+                with db.engine.connect() as default_connection:
+                    self._remove_stale_copies(default_connection, shard_connections)
+            finally:
+                for connection in shard_connections:
+                    connection.close()
+
+        for shard, engine in enumerate(self._engines):
+            self._check_shard_database(engine, tasks_table, shard)
+
+        self._executor = ThreadPoolExecutor(max_workers=self.shard_count + 1, thread_name_prefix="task_shard")
+
+        @app.teardown_appcontext
+        def remove_shard_sessions(exception=None):
+            for session in self._sessions:
+                session.remove()
+
+    @staticmethod
+    def _check_default_database(engine, tasks_table):
+        """Refuse to shard a default database that would break routing or reuse task IDs."""
+        with engine.connect() as connection:
+            tasks_sql = get_table_sql(connection, tasks_table.name)
+
+            # The table is created later by the migrations, from the current model
+            if tasks_sql is None:
+                return
+
+            if "AUTOINCREMENT" not in tasks_sql.upper():
+                raise RuntimeError(
+                    "The tasks table was created without AUTOINCREMENT, so IDs of tasks moved to a shard "
+                    "could be reused. Run `flask tasks shard` before enabling TASK_SHARD_COUNT."
+                )
+
+            assigned_tasks = connection.execute(
+                select(func.count()).select_from(tasks_table).where(tasks_table.c.user_id.is_not(None))
+            ).scalar()
+
+            if assigned_tasks:
+                raise RuntimeError(
+                    f"The default database holds {assigned_tasks} tasks assigned to users. "
+                    "Run `flask tasks shard` to move them to their shard before enabling TASK_SHARD_COUNT."
+                )
+
+    def _check_shard_database(self, engine, tasks_table, shard):
+        """Refuse to start when a shard holds tasks routed elsewhere, e.g. after changing TASK_SHARD_COUNT."""
+        with engine.connect() as connection:
+            misplaced_tasks = connection.execute(
+                select(func.count()).select_from(tasks_table).where(
+                    tasks_table.c.user_id.is_(None) | (tasks_table.c.user_id % self.shard_count != shard)
+                )
+            ).scalar()
+
+        if misplaced_tasks:
+            raise RuntimeError(
+                f"Shard {shard} holds {misplaced_tasks} tasks that belong to another shard. "
+                "TASK_SHARD_COUNT must not change once tasks have been sharded."
+            )
+
+    def _remove_stale_copies(self, default, shard_connections, task_id=None):
+        """Complete the moves that failed before the copy in the previous shard was deleted.
+
+        `default` and `shard_connections` may be sessions or connections.
+        """
+        tasks_table = self.db.metadata.tables["tasks"]
+        task_shards = self.db.metadata.tables["task_shards"]
+
+        query = select(task_shards.c.task_id, task_shards.c.shard, task_shards.c.previous_shard).where(
+            task_shards.c.previous_shard.is_not(None)
+        )
+        if task_id is not None:
+            query = query.where(task_shards.c.task_id == task_id)
+
+        for stale_task_id, shard, previous_shard in default.execute(query).all():
+            if previous_shard != shard:
+                shard_connection = shard_connections[previous_shard]
+                shard_connection.execute(delete(tasks_table).where(tasks_table.c.id == stale_task_id))
+                shard_connection.commit()
+
+            default.execute(
+                update(task_shards).where(task_shards.c.task_id == stale_task_id).values(previous_shard=None)
+            )
+
+        default.commit()
+
+    def remove_stale_copy(self, task_id):
+        """Delete the copy of a task left in its previous shard by a move that did not complete."""
+        if not self.enabled:
+            return
+
+        self._remove_stale_copies(self.db.session(), [session() for session in self._sessions], task_id)
+
+    def shard_for_user(self, user_id):
+        """Get the shard number holding the tasks of a user, None for the default database."""
+        if not self.enabled or user_id is None:
+            return None
+
+        return user_id % self.shard_count
+
+    def session_for_user(self, user_id):
+        """Get the session of the shard holding the tasks of a user (the default one if unassigned)."""
+        shard = self.shard_for_user(user_id)
+
+        if shard is None:
+            return self.db.session()
+
+        return self._sessions[shard]()
+
+    def session_for_task(self, task_id):
+        """Get the session of the shard holding a task, as recorded in the shard directory."""
+        if not self.enabled:
+            return self.db.session()
+
+        task_shards = self.db.metadata.tables["task_shards"]
+        shard = self.db.session.execute(
+            select(task_shards.c.shard).where(task_shards.c.task_id == task_id)
+        ).scalar()
+
+        if shard is None:
+            return self.db.session()
+
+        return self._sessions[shard]()
+
+    def sessions(self):
+        """Get the sessions of every shard, starting with the default one."""
+        return [self.db.session(), *(session() for session in self._sessions)]
+
+    def scatter(self, fn):
+        """Run `fn(session)` on every shard in parallel and return the results in shard order.
+
+        Each call gets its own short-lived session, so the returned objects are detached.
+        """
+        if not self.enabled:
+            return [fn(self.db.session)]
+
+        engines = [self.db.engine, *self._engines]
+
+        return list(self._executor.map(lambda engine: self._run(engine, fn), engines))
+
+    @staticmethod
+    def _run(engine, fn):
+        with Session(engine) as session:
+            return fn(session)